@@ -1,9 +1,9 @@
 # backend/api/admin_router.py
 from fastapi import APIRouter, Request, Depends, HTTPException, Query
 from typing import List, Dict
-from datetime import datetime, timedelta
 import sqlite3
 from ..services import db as db_service
+from ..services import llm_handler
 
 router = APIRouter()
 
@@ -22,7 +22,6 @@ def list_conversations(limit: int = 50) -> List[Dict]:
     cur = conn.cursor()
     cur.execute("SELECT id, session_id, title, created_at, last_activity FROM conversations ORDER BY last_activity DESC LIMIT ?", (limit,))
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 @router.get("/cleanup/preview", dependencies=[Depends(require_key)])
@@ -31,19 +30,14 @@ def cleanup_preview(ttl_seconds: int = None):
     Preview conversations that WOULD be deleted by cleanup (no deletion).
     """
     ttl = ttl_seconds if ttl_seconds is not None else db_service.SESSION_TTL_SECONDS
-    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
-    cutoff_iso = cutoff.isoformat() + "Z"
+    cutoff_iso = db_service.cutoff_iso(ttl)
     conn = db_service._get_conn()
     cur = conn.cursor()
-    # ensure column exists
-    cur.execute("PRAGMA table_info(conversations);")
-    cols = [r["name"] for r in cur.fetchall()]
-    if "last_activity" not in cols:
-        conn.close()
+    # ensure column exists (schema is checked once at startup by the db service)
+    if not db_service.HAS_LAST_ACTIVITY:
         return {"preview": [], "note": "no last_activity column present"}
     cur.execute("SELECT id, session_id, last_activity FROM conversations WHERE last_activity < ? ORDER BY last_activity ASC", (cutoff_iso,))
     rows = cur.fetchall()
-    conn.close()
     return {"preview": [dict(r) for r in rows], "cutoff_iso": cutoff_iso, "ttl_seconds": ttl}
 
 @router.post("/cleanup/run", dependencies=[Depends(require_key)])
@@ -54,6 +48,13 @@ def cleanup_run():
     deleted = db_service.cleanup_old_sessions()
     return {"deleted": deleted}
 
+@router.get("/cache/stats", dependencies=[Depends(require_key)])
+def cache_stats():
+    """
+    LLM response cache size and hit/miss counters (per worker process).
+    """
+    return {"llm_response": llm_handler.cache_stats()}
+
 @router.delete("/conversation/{conversation_id}", dependencies=[Depends(require_key)])
 def delete_conversation(conversation_id: str):
     ok = db_service.delete_conversation(conversation_id)
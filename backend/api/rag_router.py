@@ -1,52 +1,117 @@
 # backend/api/rag_router.py
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import os
 import re
-import json
+import asyncio
+import heapq
+import itertools
 import logging
 import time
+import threading
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
+import orjson
+from rank_bm25 import BM25Okapi
 
 from ..services import llm_handler, db
+from ..services.ttl_cache import TTLCache
+from ..config import RAG_TOOL_CALLING
 
 router = APIRouter()
 logger = logging.getLogger("rag_router")
 
+# Read once at import instead of on every request
+LLM_MODEL = os.environ.get("LLM_MODEL", None)  # None -> llm_handler.DEFAULT_MODEL
+LEAD_THRESHOLD = float(os.environ.get("LEAD_THRESHOLD", 0.75))
+logger.info(
+    "ENV LLM_MODEL present? %s | OPENAI_KEY present? %s",
+    bool(LLM_MODEL),
+    bool(os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_APIKEY")),
+)
+
 # Local RAG master context path (fallback) — ensure .json file
 CONTEXT_PATH = Path("context/fynorra_master_with_faqs.json")
 
 
+# Parsed master context, reused until the backing file's mtime changes
+_CTX_CACHE = {"mtime": None, "data": {}, "index": None}
+_CTX_LOCK = threading.Lock()
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def _normalize_master_context(data: dict) -> dict:
+    if "company_profile" in data and "company" not in data:
+        data["company"] = data.get("company_profile")
+    if "core_services" in data and "services" not in data:
+        svc_list = []
+        for grp in data.get("core_services", []):
+            for s in grp.get("services", []):
+                svc_list.append(s)
+        data["services"] = svc_list
+    return data
+
+
+_CTX_CANDIDATES = (
+    CONTEXT_PATH,
+    Path("context/fynorra_master_with_faqs"),
+    Path("context/fynorra_master_combined.json"),
+    Path("/context/fynorra_master_with_faqs.json"),
+    Path("/context/fynorra_master_combined.json"),
+)
+# Resolved once at import; requests only stat this one file for its mtime.
+# FYNORRA_CONTEXT_PATH skips probing entirely (e.g. in containers).
+_CTX_PATH_OVERRIDE = os.environ.get("FYNORRA_CONTEXT_PATH")
+_RESOLVED_CTX_PATH = (
+    Path(_CTX_PATH_OVERRIDE) if _CTX_PATH_OVERRIDE
+    else next((p for p in _CTX_CANDIDATES if p.exists()), None)
+)
+
+
 def load_master_context() -> dict:
-    candidates = [
-        CONTEXT_PATH,
-        Path("context/fynorra_master_with_faqs"),
-        Path("context/fynorra_master_combined.json"),
-        Path("/context/fynorra_master_with_faqs.json"),
-        Path("/context/fynorra_master_combined.json"),
-    ]
-    for p in candidates:
+    p = _RESOLVED_CTX_PATH
+    if p is None:
+        return {}
+    try:
+        mtime = os.stat(p).st_mtime_ns
+    except OSError:
+        return {}
+    if _CTX_CACHE["mtime"] == mtime:
+        return _CTX_CACHE["data"]
+    with _CTX_LOCK:
+        # another thread may have reloaded while we waited
+        if _CTX_CACHE["mtime"] == mtime:
+            return _CTX_CACHE["data"]
         try:
-            if p.exists():
-                with open(p, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    if "company_profile" in data and "company" not in data:
-                        data["company"] = data.get("company_profile")
-                    if "core_services" in data and "services" not in data:
-                        svc_list = []
-                        for grp in data.get("core_services", []):
-                            for s in grp.get("services", []):
-                                svc_list.append(s)
-                        data["services"] = svc_list
-                    return data
+            data = _normalize_master_context(orjson.loads(p.read_bytes()))
+            _CTX_CACHE.update(mtime=mtime, data=data, index=_build_context_index(data))
+            return data
         except Exception as e:
             logger.exception("Failed to load master context from %s: %s", p, e)
     return {}
 
 
+def _context_version() -> str:
+    """
+    Version of the master context (its mtime), refreshed from disk if the file changed.
+    Keys caches whose entries were derived from the context.
+    """
+    load_master_context()
+    return str(_CTX_CACHE["mtime"])
+
+
+_WS_TOKEN_RE = re.compile(r"\S+")
+
+
 def text_tokens_preview(text: str, n: int = 50) -> str:
-    return (" ".join((text or "").split()[:n])).strip()
+    # stop after n tokens instead of splitting the whole text
+    return " ".join(m.group() for m in itertools.islice(_WS_TOKEN_RE.finditer(text or ""), n))
 
 
 def _extract_text_from_rag_entry(entry) -> str:
@@ -60,81 +125,132 @@ def _extract_text_from_rag_entry(entry) -> str:
         if "messages" in entry:
             msgs = entry.get("messages", [])
             return " ".join([m.get("content", "") for m in msgs if isinstance(m, dict)])
-        return json.dumps(entry, ensure_ascii=False)
+        return orjson.dumps(entry).decode()
     return str(entry)
 
 
-def find_relevant_chunks(text: str, max_chunks: int = 3) -> List[str]:
-    data = load_master_context()
-    if not data:
-        return []
+def _company_summary(data: dict) -> str:
+    company = data.get("company", {}) or {}
+    return company.get("short_bio") or company.get("about") or company.get("business_activity") or ""
 
-    text_l = (text or "").lower()
-    if not text_l:
-        company = data.get("company", {}) or {}
-        summary = company.get("short_bio") or company.get("about") or company.get("business_activity") or ""
-        return [f"Company summary: {summary}"] if summary else []
 
-    tokens = text_l.split()
-    tokens_sample = set(tokens[:8])
-    snippets = []
+def _build_context_index(data: dict) -> dict:
+    """
+    Flatten services / FAQs / sales material into snippet strings once per load
+    and build an inverted token -> snippet-id posting map over them.
+    """
+    entries = []  # (snippet, text to index)
 
     for svc in data.get("services", []):
         name = svc.get("service_name") or svc.get("name") or svc.get("service_id") or ""
         desc = svc.get("short_description") or svc.get("description") or svc.get("sales_pitch") or ""
-        combined = f"{name} {desc}".lower()
-        if tokens_sample & set(combined.split()) or any(t in combined for t in tokens_sample):
-            snippets.append(f"Service: {name} — {desc}")
+        entries.append((f"Service: {name} — {desc}", f"{name} {desc}"))
 
     for grp in data.get("core_services", []):
         for svc in grp.get("services", []):
             name = svc.get("name", "")
             desc = svc.get("description", "")
-            combined = f"{name} {desc}".lower()
-            if tokens_sample & set(combined.split()) or any(t in combined for t in tokens_sample):
-                snippets.append(f"Service: {name} — {desc}")
+            entries.append((f"Service: {name} — {desc}", f"{name} {desc}"))
 
     faqs_root = data.get("faqs", {}) or {}
     for entry in (faqs_root.get("rag_formatted") or []):
         entry_text = _extract_text_from_rag_entry(entry).lower()
-        if tokens_sample & set(entry_text.split()) or any(t in entry_text for t in tokens_sample):
-            preview = entry_text.replace("\n", " ").strip()[:600]
-            snippets.append(f"FAQ: {preview}")
+        preview = entry_text.replace("\n", " ").strip()[:600]
+        entries.append((f"FAQ: {preview}", entry_text))
 
     for entry in (faqs_root.get("plain") or faqs_root.get("qa") or []):
         q = entry.get("q") or entry.get("question") or ""
         a = entry.get("a") or entry.get("answer") or ""
-        combined = f"{q} {a}".lower()
-        if tokens_sample & set(combined.split()) or any(t in combined for t in tokens_sample):
-            snippets.append(f"FAQ: Q: {q} A: {a}")
+        entries.append((f"FAQ: Q: {q} A: {a}", f"{q} {a}"))
 
     sm = data.get("sales_material", {}) or {}
     hero = sm.get("hero_headline", "")
     pitch = sm.get("elevator_pitch", "")
     if hero or pitch:
-        combined = f"{hero} {pitch}".lower()
-        if tokens_sample & set(combined.split()) or any(t in combined for t in tokens_sample):
-            snippets.append(f"Sales: {hero} — {pitch}")
+        entries.append((f"Sales: {hero} — {pitch}", f"{hero} {pitch}"))
 
-    # dedupe & clamp
+    snippets: List[str] = []
+    corpus_tokens: List[List[str]] = []
+    postings: dict = {}
     seen = set()
-    out = []
-    for s in snippets:
-        if s and s not in seen:
-            seen.add(s)
-            out.append(s)
-        if len(out) >= max_chunks:
-            break
+    for snippet, text in entries:
+        if not snippet or snippet in seen:
+            continue
+        seen.add(snippet)
+        sid = len(snippets)
+        tokens = _tokenize(text)
+        snippets.append(snippet)
+        corpus_tokens.append(tokens)
+        for tok in set(tokens):
+            postings.setdefault(tok, []).append(sid)
+
+    # BM25Okapi divides by corpus size, so only build it when there is something to rank
+    bm25 = BM25Okapi(corpus_tokens) if corpus_tokens else None
+    return {"snippets": snippets, "postings": postings, "bm25": bm25}
+
+
+def rank_local_snippets(text: str, top_k: int = 3) -> List[str]:
+    """
+    BM25-ranked master-context snippets for `text`, best first (no summary fallback).
+    """
+    if not load_master_context():
+        return []
+    index = _CTX_CACHE["index"] or {"snippets": [], "postings": {}, "bm25": None}
+    postings = index["postings"]
+    query_tokens = list(dict.fromkeys(_tokenize(text)))
+    candidates = set()
+    for tok in query_tokens:
+        candidates.update(postings.get(tok, ()))
+    if not candidates or index["bm25"] is None:
+        return []
+
+    # score only documents sharing a token with the query; ties keep corpus order
+    ids = sorted(candidates)
+    scores = index["bm25"].get_batch_scores(query_tokens, ids)
+    # partial top-k selection instead of sorting every candidate
+    ranked = heapq.nlargest(top_k, zip(ids, scores), key=lambda x: x[1])
+    return [index["snippets"][sid] for sid, _ in ranked]
+
+
+def find_relevant_chunks(text: str, max_chunks: int = 3) -> List[str]:
+    data = load_master_context()
+    if not data:
+        return []
+
+    if not _tokenize(text):
+        summary = _company_summary(data)
+        return [f"Company summary: {summary}"] if summary else []
+
+    out = rank_local_snippets(text, top_k=max_chunks)
 
     if not out:
-        company = data.get("company", {}) or {}
-        summary = company.get("short_bio") or company.get("about") or company.get("business_activity") or ""
+        summary = _company_summary(data)
         if summary:
             out.append(f"Company summary: {text_tokens_preview(summary, 60)}")
 
     return out
 
 
+# Reciprocal Rank Fusion constant (standard value from Cormack et al.)
+RRF_K = 60
+
+
+def _rrf_fuse(rankings: List[List[tuple]], top_n: int, k: int = RRF_K) -> List[str]:
+    """
+    Fuse several best-first rankings of (text, source_part) pairs with RRF.
+    Items are de-duplicated on their whitespace/case-normalized text.
+    """
+    scores: dict = {}
+    parts: dict = {}
+    for ranking in rankings:
+        for rank, (text, part) in enumerate(ranking, start=1):
+            key = hash(" ".join((text or "").lower().split()))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            parts.setdefault(key, part)
+    # only the top_n survivors are ordered, not every fused candidate
+    return [parts[key] for key in heapq.nlargest(top_n, scores, key=scores.get)]
+
+
 # COMPANY_INFO_RE updated to English (broader)
 COMPANY_INFO_RE = re.compile(
     r"\b(?:"
@@ -149,6 +265,86 @@ COMPANY_INFO_RE = re.compile(
 )
 
 
+# Language preference detector (user explicitly asks for Hindi/Hinglish)
+_HINGLISH_RE = re.compile(r"\b(hindi|hinglish|हिंदी|हिंग्लिश|bol in hindi|bol hindi|हेलो हिंदी)\b", re.I)
+
+# Lead detection: contact details and weighted intent keywords, scanned in one pass.
+_EMAIL_PATTERN = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
+_PHONE_PATTERN = r"\+?\d[\d\s\-\(\)]{6,}\d"
+CONTACT_LEAD_SCORE = 0.98  # any email/phone in the exchange is a near-certain lead
+
+# (group, alternatives, weight), highest weight first so a position's best class wins
+_LEAD_KEYWORDS = [
+    ("demo", r"demo|schedule demo|book demo", 0.95),
+    ("pricing", r"price|pricing|cost|quote", 0.85),
+    ("meeting", r"schedule|meeting|request demo", 0.8),
+    ("intent", r"interested|want to buy|purchase|signup|sign up|get started", 0.75),
+    ("contact", r"contact|call me|reach out|connect", 0.65),
+]
+# Each alternative is a lookahead, so overlapping matches (e.g. "demo" inside
+# "request demo") are still seen at their own start position.
+_LEAD_RE = re.compile(
+    "|".join(
+        [rf"(?=(?P<email>{_EMAIL_PATTERN}))", rf"(?=(?P<phone>{_PHONE_PATTERN}))"]
+        + [rf"(?=\b(?P<{g}>{alts})\b)" for g, alts, _ in _LEAD_KEYWORDS]
+    ),
+    re.I,
+)
+_LEAD_WEIGHTS = {g: w for g, _, w in _LEAD_KEYWORDS}
+
+
+def scan_lead_signals(text: str) -> Tuple[float, bool, bool]:
+    """
+    Single scan for lead signals. Returns (score, has_email, has_phone); the scan
+    stops at the first email/phone, which lifts the score to CONTACT_LEAD_SCORE.
+    """
+    score, has_email, has_phone = 0.0, False, False
+    for m in _LEAD_RE.finditer(text or ""):
+        group = m.lastgroup
+        if group == "email":
+            has_email = True
+        elif group == "phone":
+            has_phone = True
+        elif _LEAD_WEIGHTS[group] > score:
+            score = _LEAD_WEIGHTS[group]
+        if has_email or has_phone:
+            # contact beats every keyword weight; nothing later can change the outcome
+            return max(score, CONTACT_LEAD_SCORE), has_email, has_phone
+    return score, has_email, has_phone
+
+
+# Cheap substring pre-filter covering every _LEAD_RE keyword plus "@" for emails
+_FAST_LEAD_HINTS = (
+    "demo", "pric", "cost", "quote", "schedule", "meeting", "interested", "buy",
+    "purchase", "sign", "started", "contact", "call", "reach", "connect", "@",
+)
+_QUESTION_WORDS = ("what", "who", "how", "tell", "batao", "kya")
+
+# Service questions answered with a static reply; one alternation scans the message once
+_QUICK_SERVICES_PHRASES = (
+    "what services",
+    "what do you offer",
+    "services fynorra",
+    "what services fynorra provide",
+    "services you provide",
+    "what services do you provide",
+)
+_QUICK_SERVICES_RE = re.compile("|".join(map(re.escape, _QUICK_SERVICES_PHRASES)))
+
+
+def _is_plain_short_question(message_text: str, text_lower: Optional[str] = None) -> bool:
+    """
+    True for short "what/who/how ..." questions with no lead hint (keyword, email or digits).
+    Pass `text_lower` when the caller already has the lowercased message.
+    """
+    msg_l = text_lower if text_lower is not None else (message_text or "").lower()
+    if len(msg_l.split()) >= 6 or not any(qw in msg_l for qw in _QUESTION_WORDS):
+        return False
+    if any(h in msg_l for h in _FAST_LEAD_HINTS) or any(ch.isdigit() for ch in msg_l):
+        return False
+    return True
+
+
 # Persona: tighten instruction to LLM to answer directly without prefaces.
 BASE_PERSONA = (
     "You are Fynorra AI Assistant — the official AI representative of Fynorra AI Solutions. "
@@ -162,26 +358,75 @@ BASE_PERSONA = (
 )
 
 
-def _is_short_greeting(txt: str) -> bool:
+_GREETINGS = (
+    "hi", "hello", "hey", "hiya", "yo", "good morning", "good evening",
+    "hello ji", "namaste", "namaste ji",
+)
+# message is a greeting, starts with "<greeting> " or ends with " <greeting>"
+_GREET_SET = frozenset(_GREETINGS)
+_GREET_PREFIX = tuple(g + " " for g in _GREETINGS)
+_GREET_SUFFIX = tuple(" " + g for g in _GREETINGS)
+
+# Replies to the "overview or needs?" choice prompt (substring match, checked in this order)
+_CHOICE_INTENTS = (
+    ("SERVICES", re.compile(r"service|overview|explain|what do you offer|show me")),
+    ("NEEDS", re.compile(r"need|automate|problem|project|help|use case|business|we want")),
+    ("DEMO", re.compile(r"demo|call|schedule|meeting")),
+)
+
+
+def _is_short_greeting(txt: str, text_lower: Optional[str] = None) -> bool:
     if not txt:
         return False
-    t = txt.lower().strip()
-    greetings = [
-        "hi",
-        "hello",
-        "hey",
-        "hiya",
-        "yo",
-        "good morning",
-        "good evening",
-        "hello ji",
-        "namaste",
-        "namaste ji",
-    ]
-    if any(t == g or t.startswith(g + " ") or t.endswith(" " + g) for g in greetings):
-        if len(t.split()) <= 4:
-            return True
-    return False
+    t = (text_lower if text_lower is not None else txt.lower()).strip()
+    if t in _GREET_SET:
+        return True
+    return (t.startswith(_GREET_PREFIX) or t.endswith(_GREET_SUFFIX)) and len(t.split()) <= 4
+
+
+def interpret_choice_reply(txt: str, text_lower: Optional[str] = None) -> str:
+    t = text_lower if text_lower is not None else (txt or "").lower()
+    for intent, pattern in _CHOICE_INTENTS:
+        if pattern.search(t):
+            return intent
+    return "UNKNOWN"
+
+
+# Leading greetings / stock lead-ins stripped from replies by _clean_reply. One optional
+# group per opener, in the original order, so each is stripped at most once in a single pass.
+_RE_LEAD_STRIP = re.compile(
+    r"^(?:\s*namaste[^\n]*\n*)?"
+    r"(?:\s*hi[^\n]*\n*)?"
+    r"(?:\s*hello[^\n]*\n*)?"
+    r"(?:\s*hey[^\n]*\n*)?"
+    r"(?:\s*how can i (?:help|assist) you (?:today)?[.?!]*\n*)?"
+    r"(?:\s*how may i help you[.?!]*\n*)?",
+    re.I,
+)
+_RE_MULTI_NL = re.compile(r"\n{3,}")
+# Has the assistant already greeted in this conversation?
+_RE_GREETING_HISTORY = re.compile(r"\b(namaste|hi|hello)\b", re.I)
+# Did the assistant ask the "overview or needs?" choice question?
+_RE_ASKED_CHOICE = re.compile(r"^(?=.*would you like)(?=.*(?:overview|talk about your business needs))", re.I | re.S)
+
+
+def _scan_assistant_history(history: List[dict]) -> Tuple[bool, bool]:
+    """
+    One newest-first pass over assistant turns. Returns (has_greeted, asked_choice);
+    stops as soon as both are known.
+    """
+    has_greeted = asked_choice = False
+    for m in reversed(history):
+        if m.get("role") != "assistant":
+            continue
+        txt = m.get("text") or ""
+        if not has_greeted and _RE_GREETING_HISTORY.search(txt):
+            has_greeted = True
+        if not asked_choice and _RE_ASKED_CHOICE.search(txt):
+            asked_choice = True
+        if has_greeted and asked_choice:
+            break
+    return has_greeted, asked_choice
 
 
 def _clean_reply(reply: str, user_message: str, allow_greeting: bool) -> str:
@@ -198,24 +443,285 @@ def _clean_reply(reply: str, user_message: str, allow_greeting: bool) -> str:
 
     # remove leading greetings unless we explicitly allow greeting
     if not allow_greeting:
-        # common greeting starters to strip
-        r = re.sub(r"^\s*(namaste[^\n]*[\n]*)", "", r, flags=re.I)
-        r = re.sub(r"^\s*(hi[^\n]*[\n]*)", "", r, flags=re.I)
-        r = re.sub(r"^\s*(hello[^\n]*[\n]*)", "", r, flags=re.I)
-        r = re.sub(r"^\s*(hey[^\n]*[\n]*)", "", r, flags=re.I)
-
-        # remove stock lead-ins like "How can I help you today?" if at start
-        r = re.sub(r"^\s*(how can i (help|assist) you (today)?[.?!]*[\n]*)", "", r, flags=re.I)
-        r = re.sub(r"^\s*(how may I help you[.?!]*[\n]*)", "", r, flags=re.I)
+        # common greeting starters and stock lead-ins like "How can I help you today?"
+        r = _RE_LEAD_STRIP.sub("", r, count=1)
 
     # trim excessive whitespace and repeated newlines
-    r = re.sub(r"\n{3,}", "\n\n", r).strip()
+    r = _RE_MULTI_NL.sub("\n\n", r).strip()
 
     return r
 
 
+async def _vector_search(message_text: str) -> List[tuple]:
+    """
+    Vector hits as a best-first list of (text, source_part) pairs.
+    """
+    ranked: List[tuple] = []
+    try:
+        hits = []
+        if hasattr(db, "search_documents"):
+            hits = await run_in_threadpool(db.search_documents, message_text, top_k=4) or []
+        elif hasattr(db, "search_services"):
+            hits = await run_in_threadpool(db.search_services, message_text, top_k=4) or []
+
+        for h in hits:
+            meta_name = (h.get("metadata") or {}).get("service_name") or h.get("id") or h.get("metadata", {}).get("title")
+            text = h.get("text") or h.get("snippet") or ""
+            ranked.append((text, f"[VECTOR-HIT] {meta_name}\n{text[:1500]}"))
+    except Exception as e:
+        logger.debug("Vector search failed: %s", e)
+    return ranked
+
+
+async def _fetch_company_profile():
+    if not hasattr(db, "fetch_by_id"):
+        return None
+    try:
+        return await run_in_threadpool(db.fetch_by_id, "company_profile")
+    except Exception:
+        return None
+
+
+async def _noop():
+    return None
+
+
+SOURCE_SEPARATOR = "\n\n--- SOURCE ---\n\n"
+# Bound the retrieved context so prompt size (and LLM tokens) stays predictable
+MAX_SOURCE_PARTS = 4
+SOURCES_MAX_CHARS = int(os.environ.get("RAG_SOURCES_MAX_CHARS", 6000))
+
+
+def _apply_source_budget(parts: List[str]) -> List[str]:
+    """
+    Keep at most MAX_SOURCE_PARTS parts, best first, stopping before the total length
+    exceeds SOURCES_MAX_CHARS. The first part is always kept (truncated if needed).
+    """
+    out: List[str] = []
+    used = 0
+    for part in parts[:MAX_SOURCE_PARTS]:
+        if not out:
+            part = part[:SOURCES_MAX_CHARS]
+        elif used + len(SOURCE_SEPARATOR) + len(part) > SOURCES_MAX_CHARS:
+            break
+        else:
+            used += len(SOURCE_SEPARATOR)
+        out.append(part)
+        used += len(part)
+    return out
+
+# Tool exposed to the LLM so retrieval only runs for turns that actually need company context
+SEARCH_CONTEXT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_fynorra_context",
+        "description": (
+            "Search Fynorra's company profile, services, FAQs and documents. "
+            "Call this before answering any question about Fynorra, its services, pricing or team."
+        ),
+        "parameters": {
+            "type": "object",
+            "properties": {"query": {"type": "string", "description": "What to look up."}},
+            "required": ["query"],
+        },
+    },
+}
+TOOL_PERSONA = "Use the search_fynorra_context tool to look up company facts; never answer company questions from memory."
+
+# Only two language variants exist (plus the tool instruction), so the system prompts are built once
+_SYS_PROMPT_EN = BASE_PERSONA + "\nPrefer English in responses. Switch to Hinglish only if user asks."
+_SYS_PROMPT_HI = BASE_PERSONA + "\nUse Hinglish for responses."
+if RAG_TOOL_CALLING:
+    _SYS_PROMPT_EN += "\n" + TOOL_PERSONA
+    _SYS_PROMPT_HI += "\n" + TOOL_PERSONA
+
+
+# Repeated questions skip vector search and the local ranking for a few minutes
+_RETRIEVAL_CACHE = TTLCache(maxsize=512, ttl_seconds=300)
+
+
+async def _retrieve_sources(message_text: str) -> List[str]:
+    """
+    Build the tagged source parts for the LLM context. Vector search and the
+    company-profile lookup run concurrently; local BM25 ranking is in-process.
+    Non-empty results are cached briefly per normalized query and context version.
+    """
+    # a reloaded master context starts a fresh set of entries
+    cache_key = (_context_version(), " ".join((message_text or "").lower().split()))
+    cached = _RETRIEVAL_CACHE.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    is_company_query = bool(COMPANY_INFO_RE.search(message_text))
+    vector_ranked, cp = await asyncio.gather(
+        _vector_search(message_text),
+        _fetch_company_profile() if is_company_query else _noop(),
+    )
+
+    local_ranked: List[tuple] = []
+    try:
+        local_ranked = [(c, f"[LOCAL] {c}") for c in rank_local_snippets(message_text, top_k=4)]
+    except Exception as e:
+        logger.exception("Local retrieval error: %s", e)
+
+    # Hybrid retrieval: fuse vector and BM25 rankings with RRF
+    sources_parts: List[str] = _rrf_fuse([vector_ranked, local_ranked], top_n=4)
+
+    # If nothing matched or the question is about company identity, use the company profile / summary
+    if not sources_parts or is_company_query:
+        try:
+            if cp is None and not is_company_query:
+                cp = await _fetch_company_profile()
+            if cp and isinstance(cp, dict):
+                cp_meta = cp.get("metadata") or {}
+                # the JSON dump is only a last resort when the profile has no text field
+                cp_text = cp_meta.get("text") or cp.get("text") or orjson.dumps(cp, default=str).decode()
+                verified = cp_meta.get("verified", False)
+                prefix = "" if verified else "(According to public records) "
+                sources_parts.insert(0, f"[COMPANY_PROFILE] {prefix}{cp_text[:1200]}")
+            elif not sources_parts:
+                master = load_master_context()
+                company_summary = master.get("company", {}).get("short_bio") or master.get("company", {}).get("about") or ""
+                if company_summary:
+                    sources_parts.append(f"[LOCAL] Company summary: {text_tokens_preview(company_summary, 120)}")
+        except Exception as e:
+            logger.exception("Fallback retrieval error: %s", e)
+
+    sources_parts = _apply_source_budget(sources_parts)
+    if sources_parts:
+        _RETRIEVAL_CACHE.put(cache_key, tuple(sources_parts))
+    return sources_parts
+
+
+async def _context_tool_handler(name: str, args: dict) -> str:
+    if name != "search_fynorra_context":
+        return ""
+    sources_parts = await _retrieve_sources(str(args.get("query") or ""))
+    return SOURCE_SEPARATOR.join(sources_parts).strip() or "No matching company context found."
+
+
+def _save_turn(background_tasks: BackgroundTasks, conversation_id: str, user_msg: dict, reply: str):
+    """
+    Queue the user message and the assistant reply as one batched write after the response.
+    """
+    background_tasks.add_task(
+        db.save_messages,
+        conversation_id,
+        [user_msg, {"role": "assistant", "text": reply, "file_url": None}],
+    )
+
+
+def _notify_sales_safe(lead: dict):
+    try:
+        db.notify_sales(lead)
+    except Exception as e:
+        logger.exception("Notify sales failed: %s", e)
+
+
+FALLBACK_REPLY = "I don't have that information right now. Would you like me to connect you with our team?"
+
+
+class OrjsonResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson (fastapi.responses.ORJSONResponse is deprecated).
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+def _respond(stream: bool, payload: dict, status_code: int = 200):
+    """
+    JSON for regular clients; a single SSE "done" event for clients that asked for a stream.
+    """
+    if stream:
+        return StreamingResponse(iter([_sse("done", payload)]), media_type="text/event-stream", status_code=status_code)
+    return OrjsonResponse(payload, status_code=status_code)
+
+
+async def _detect_lead(conversation_id: str, message_text: str, reply: str, background_tasks: BackgroundTasks,
+                       text_lower: Optional[str] = None):
+    """
+    Score the exchange, create a lead above LEAD_THRESHOLD and queue the sales notification.
+    Returns (is_lead, lead).
+    """
+    # short informational questions without any lead hint are skipped outright
+    if _is_plain_short_question(message_text, text_lower):
+        score_combined, contact_email_present, contact_phone_present = 0.0, False, False
+    else:
+        combined_text = (message_text or "") + " " + (reply or "")
+        score_combined, contact_email_present, contact_phone_present = scan_lead_signals(combined_text)
+
+    is_lead = score_combined >= LEAD_THRESHOLD
+
+    lead = None
+    if is_lead:
+        lead = await run_in_threadpool(
+            db.create_lead,
+            conversation_id,
+            snippet=(message_text or "")[:500],
+            score=float(score_combined),
+            metadata={"detected_contact": contact_email_present or contact_phone_present},
+        )
+        background_tasks.add_task(_notify_sales_safe, lead)
+    return is_lead, lead
+
+
+def _save_user_turn_safe(conversation_id: str, user_msg: dict, debug_id: str):
+    try:
+        db.save_messages(conversation_id, [user_msg])
+    except Exception as e:
+        logger.exception("[%s] Failed to save user turn after disconnect: %s", debug_id, e)
+
+
+async def _stream_chat(llm_kwargs: dict, conversation_id: str, session_id: str, user_msg: dict,
+                       background_tasks: BackgroundTasks, debug_id: str,
+                       allow_greeting: bool = False, text_lower: Optional[str] = None):
+    """
+    SSE generator: "token" events carry raw deltas; the final "done" event carries the
+    cleaned reply plus lead info (same shape as the JSON response).
+    """
+    message_text = user_msg["text"]
+    parts: List[str] = []
+    turn_queued = False
+    try:
+        try:
+            async for delta in llm_handler.stream_llm_response(**llm_kwargs):
+                parts.append(delta)
+                yield _sse("token", {"delta": delta})
+        except Exception as e:
+            logger.exception("[%s] LLM stream exception: %s", debug_id, e)
+            err_msg = "⚠️ Assistant failed to generate a response (LLM error). Check server logs."
+            _save_turn(background_tasks, conversation_id, user_msg, err_msg)
+            turn_queued = True
+            yield _sse("error", {"reply": err_msg, "error": str(e)})
+            return
+
+        reply = "".join(parts)
+        logger.info("[%s] LLM stream finished (len=%d)", debug_id, len(reply))
+        cleaned = _clean_reply(reply, message_text, allow_greeting=allow_greeting) or FALLBACK_REPLY
+        _save_turn(background_tasks, conversation_id, user_msg, cleaned)
+        turn_queued = True
+
+        is_lead, lead = await _detect_lead(conversation_id, message_text, cleaned, background_tasks, text_lower)
+        yield _sse("done", {"reply": cleaned, "session_id": session_id, "is_lead": is_lead, "lead": lead})
+    finally:
+        if not turn_queued:
+            # The client went away mid-stream: the response (and its background tasks) is
+            # cancelled, so store the user turn here. Nothing can be awaited while the
+            # generator is being closed, so the write is handed to the default executor.
+            try:
+                asyncio.get_running_loop().run_in_executor(None, _save_user_turn_safe, conversation_id, user_msg, debug_id)
+            except RuntimeError:  # closed outside the event loop (e.g. garbage-collected)
+                _save_user_turn_safe(conversation_id, user_msg, debug_id)
+
+
 @router.post("/chat")
-async def chat_endpoint(request: Request):
+async def chat_endpoint(request: Request, background_tasks: BackgroundTasks):
     ct = request.headers.get("content-type", "")
     message_text, session_id = "", None
 
@@ -225,60 +731,52 @@ async def chat_endpoint(request: Request):
             detail="File uploads are disabled on this deployment. Use demo project for file uploads.",
         )
 
-    body = await request.json()
+    body = orjson.loads(await request.body())
     message_text = (body.get("message") or body.get("text") or "").strip()
     session_id = body.get("session_id") or None
+    # Opt-in Server-Sent Events: {"stream": true} or an "Accept: text/event-stream" header
+    stream = bool(body.get("stream")) or "text/event-stream" in request.headers.get("accept", "")
 
-    conv = db.upsert_conversation(session_id)
+    conv = await run_in_threadpool(db.upsert_conversation, session_id)
     conversation_id, session_id = conv["id"], conv["session_id"]
 
-    db.save_message(conversation_id, role="user", text=message_text, file_url=None)
-
-    recent_history = db.get_last_messages(conversation_id, limit=20) or []
-    assistant_has_greeted = any(
-        m.get("role") == "assistant"
-        and re.search(r"\b(namaste|hi|hello)\b", (m.get("text") or ""), re.I)
-        for m in recent_history
-    )
+    # The user message is written together with the reply (one transaction, after the
+    # response); until then it only lives in this request's in-memory history.
+    user_msg = {"role": "user", "text": message_text, "file_url": None, "created_at": db.now_iso()}
+    # lowercase once; the greeting / choice / lead helpers reuse it instead of re-folding
+    msg_lower = message_text.lower()
+    is_greeting = _is_short_greeting(message_text, msg_lower)
+    is_quick_services = _QUICK_SERVICES_RE.search(msg_lower) is not None
+
+    # History and retrieval are independent: run them concurrently. Short greetings and
+    # service questions usually get a canned reply, so their retrieval is deferred until
+    # actually needed. With tool calling enabled the model requests context itself.
+    sources_parts = None
+    if RAG_TOOL_CALLING or is_greeting or is_quick_services:
+        recent_history = await run_in_threadpool(db.get_last_messages, conversation_id, limit=19) or []
+    else:
+        recent_history, sources_parts = await asyncio.gather(
+            run_in_threadpool(db.get_last_messages, conversation_id, limit=19),
+            _retrieve_sources(message_text),
+        )
+        recent_history = recent_history or []
+    recent_history.append(user_msg)
+    assistant_has_greeted, assistant_asked_choice = _scan_assistant_history(recent_history)
 
-    use_hinglish = False
-    if re.search(r"\b(hindi|hinglish|हिंदी|हिंग्लिश|bol in hindi|bol hindi|हेलो हिंदी)\b", message_text, re.I):
-        use_hinglish = True
+    use_hinglish = bool(_HINGLISH_RE.search(message_text))
 
     # ---------------------------
     # Greeting / choice logic (kept, but minimal)
     # ---------------------------
     # 1) If user sends a short greeting and assistant hasn't greeted -> reply with one-line greeting only
-    if _is_short_greeting(message_text) and not assistant_has_greeted:
+    if is_greeting and not assistant_has_greeted:
         short_greeting = "Namaste 🙏 — I’m Fynorra AI — your AI automation partner."
-        db.save_message(conversation_id, role="assistant", text=short_greeting, file_url=None)
-        return JSONResponse({"reply": short_greeting, "session_id": session_id, "is_lead": False, "lead": None})
+        _save_turn(background_tasks, conversation_id, user_msg, short_greeting)
+        return _respond(stream, {"reply": short_greeting, "session_id": session_id, "is_lead": False, "lead": None})
 
     # 2) If assistant earlier asked a choice, branch (keeps behavior)
-    def assistant_asked_choice(history) -> bool:
-        for m in reversed(history):
-            if m.get("role") == "assistant":
-                txt = (m.get("text") or "").lower()
-                if "would you like" in txt and (
-                    "overview" in txt
-                    or "talk about your business needs" in txt
-                    or "reply with 'overview' or 'needs'" in txt
-                ):
-                    return True
-        return False
-
-    def interpret_choice_reply(txt: str) -> str:
-        t = (txt or "").lower()
-        if any(w in t for w in ["service", "services", "overview", "explain", "what do you offer", "show me"]):
-            return "SERVICES"
-        if any(w in t for w in ["need", "automate", "problem", "project", "help", "use case", "business", "we want"]):
-            return "NEEDS"
-        if any(w in t for w in ["demo", "call", "schedule", "meeting"]):
-            return "DEMO"
-        return "UNKNOWN"
-
-    if assistant_asked_choice(recent_history):
-        intent = interpret_choice_reply(message_text)
+    if assistant_asked_choice:
+        intent = interpret_choice_reply(message_text, msg_lower)
         if intent == "SERVICES":
             services_overview = (
                 "AI Chatbots (Website & WhatsApp): conversational assistants for FAQs & lead capture.\n"
@@ -288,75 +786,30 @@ async def chat_endpoint(request: Request):
                 "Dashboards & Analytics: insights and predictive metrics.\n"
                 "Reply with the service name you'd like details on, or 'Demo' to schedule a call."
             )
-            db.save_message(conversation_id, role="assistant", text=services_overview, file_url=None)
-            return JSONResponse({"reply": services_overview, "session_id": session_id, "is_lead": False, "lead": None})
+            _save_turn(background_tasks, conversation_id, user_msg, services_overview)
+            return _respond(stream, {"reply": services_overview, "session_id": session_id, "is_lead": False, "lead": None})
         if intent == "NEEDS":
             discovery = (
                 "To suggest the right solution, please share: (1) the process you want to automate, (2) your industry, and (3) rough timeline/budget."
             )
-            db.save_message(conversation_id, role="assistant", text=discovery, file_url=None)
-            return JSONResponse({"reply": discovery, "session_id": session_id, "is_lead": False, "lead": None})
+            _save_turn(background_tasks, conversation_id, user_msg, discovery)
+            return _respond(stream, {"reply": discovery, "session_id": session_id, "is_lead": False, "lead": None})
         if intent == "DEMO":
             demo_msg = "Sure — to schedule a 20-min demo, please share a preferred date/time and contact email/phone."
-            db.save_message(conversation_id, role="assistant", text=demo_msg, file_url=None)
-            return JSONResponse({"reply": demo_msg, "session_id": session_id, "is_lead": True, "lead": None})
+            _save_turn(background_tasks, conversation_id, user_msg, demo_msg)
+            return _respond(stream, {"reply": demo_msg, "session_id": session_id, "is_lead": True, "lead": None})
         reprompt = "Reply 'Overview' or 'Needs' — I can give a short overview of services or ask a few questions about your needs."
-        db.save_message(conversation_id, role="assistant", text=reprompt, file_url=None)
-        return JSONResponse({"reply": reprompt, "session_id": session_id, "is_lead": False, "lead": None})
+        _save_turn(background_tasks, conversation_id, user_msg, reprompt)
+        return _respond(stream, {"reply": reprompt, "session_id": session_id, "is_lead": False, "lead": None})
 
     # -----------------------
     # Normal flow (retrieval + LLM) — build concise context
     # -----------------------
-    sources_parts: List[str] = []
-    try:
-        hits = []
-        if hasattr(db, "search_documents"):
-            hits = db.search_documents(message_text, top_k=4) or []
-        elif hasattr(db, "search_services"):
-            hits = db.search_services(message_text, top_k=4) or []
-        else:
-            hits = []
-
-        for h in hits:
-            meta_name = (h.get("metadata") or {}).get("service_name") or h.get("id") or h.get("metadata", {}).get("title")
-            text = h.get("text") or h.get("snippet") or ""
-            sources_parts.append(f"[VECTOR-HIT] {meta_name}\n{text[:1500]}")
-    except Exception as e:
-        logger.debug("Vector search failed: %s", e)
-        hits = []
+    if sources_parts is None and not RAG_TOOL_CALLING and not is_quick_services:
+        sources_parts = await _retrieve_sources(message_text)
 
-    # If no vector hits or the question is about company identity, use local master context
-    if not sources_parts or COMPANY_INFO_RE.search(message_text):
-        try:
-            cp = None
-            if hasattr(db, "fetch_by_id"):
-                try:
-                    cp = db.fetch_by_id("company_profile")
-                except Exception:
-                    cp = None
-            if cp and isinstance(cp, dict):
-                cp_text = (cp.get("metadata") or {}).get("text") or cp.get("text") or json.dumps(cp)
-                verified = (cp.get("metadata") or {}).get("verified", False)
-                prefix = "" if verified else "(According to public records) "
-                sources_parts.insert(0, f"[COMPANY_PROFILE] {prefix}{cp_text[:1200]}")
-            else:
-                chunks = find_relevant_chunks(message_text)
-                for c in chunks:
-                    sources_parts.append(f"[LOCAL] {c}")
-                if not sources_parts:
-                    master = load_master_context()
-                    company_summary = master.get("company", {}).get("short_bio") or master.get("company", {}).get("about") or ""
-                    if company_summary:
-                        sources_parts.append(f"[LOCAL] Company summary: {text_tokens_preview(company_summary, 120)}")
-        except Exception as e:
-            logger.exception("Fallback retrieval error: %s", e)
-
-    sources_text = ("\n\n--- SOURCE ---\n\n".join(sources_parts)).strip() if sources_parts else ""
-    history = recent_history[-6:] if recent_history else []
-    # include only minimal recent history (role + text) to preserve context but avoid feed repetition
-    history_text = "\n".join([f"{m['role']}: {m['text']}" for m in history]) if history else ""
-    lang_pref = "Prefer English in responses. Switch to Hinglish only if user asks." if not use_hinglish else "Use Hinglish for responses."
-    system_prompt = BASE_PERSONA + "\n" + lang_pref
+    sources_text = SOURCE_SEPARATOR.join(sources_parts).strip() if sources_parts else ""
+    system_prompt = _SYS_PROMPT_HI if use_hinglish else _SYS_PROMPT_EN
 
     # final_context: keep short, only sources (avoid feeding full history or long marketing)
     final_context = sources_text
@@ -364,46 +817,46 @@ async def chat_endpoint(request: Request):
     # ---------- DEBUG + SAFE LLM PATCH ----------
     debug_id = f"dbg-{int(time.time())}"
     logger.info("[%s] chat start: session=%s message=%s", debug_id, session_id, (message_text or "")[:400])
-    logger.info(
-        "[%s] ENV LLM_MODEL present? %s | OPENAI_KEY present? %s",
-        debug_id,
-        bool(os.environ.get("LLM_MODEL")),
-        bool(os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_APIKEY")),
-    )
 
     # Quick static fallback for urgent service queries (temporary)
-    lower_msg = (message_text or "").lower()
-    if any(
-        k in lower_msg
-        for k in [
-            "what services",
-            "what do you offer",
-            "services fynorra",
-            "what services fynorra provide",
-            "services you provide",
-            "what services do you provide",
-        ]
-    ):
+    if is_quick_services:
         quick = (
             "AI Chatbots (Website & WhatsApp); RAG Assistants (doc-backed Q&A); "
             "Document OCR & Automation; CRM Integrations; Dashboards & Analytics."
         )
-        db.save_message(conversation_id, role="assistant", text=quick, file_url=None)
+        _save_turn(background_tasks, conversation_id, user_msg, quick)
         logger.info("[%s] Returned QUICK STATIC services reply (fallback).", debug_id)
-        return JSONResponse({"reply": quick, "session_id": session_id, "is_lead": False, "lead": None})
+        return _respond(stream, {"reply": quick, "session_id": session_id, "is_lead": False, "lead": None})
+
+    logger.debug("[%s] SYSTEM_PROMPT (truncated): %s", debug_id, system_prompt[:1500])
+    logger.debug("[%s] CONTEXT (truncated): %s", debug_id, (final_context or "")[:2000])
+    llm_kwargs = dict(
+        system_prompt=system_prompt,
+        context=final_context,
+        user_question=message_text,
+        model=LLM_MODEL,
+        request_type="chat",
+        tools=[SEARCH_CONTEXT_TOOL] if RAG_TOOL_CALLING else None,
+        tool_handler=_context_tool_handler,
+        # messages with lead signals (contact details, demo/pricing intent) always get a fresh reply
+        use_cache=not any(h in msg_lower for h in _FAST_LEAD_HINTS),
+        # with tool calling `context` is empty, so cached replies are tied to the context version
+        cache_version=_context_version(),
+    )
+
+    if stream:
+        return StreamingResponse(
+            _stream_chat(
+                llm_kwargs, conversation_id, session_id, user_msg, background_tasks, debug_id,
+                allow_greeting=is_greeting, text_lower=msg_lower,
+            ),
+            media_type="text/event-stream",
+            background=background_tasks,
+        )
 
     reply = None
     try:
-        logger.debug("[%s] SYSTEM_PROMPT (truncated): %s", debug_id, system_prompt[:1500])
-        logger.debug("[%s] CONTEXT (truncated): %s", debug_id, (final_context or "")[:2000])
-
-        reply = llm_handler.get_llm_response(
-            system_prompt=system_prompt,
-            context=final_context,
-            user_question=message_text,
-            model=os.environ.get("LLM_MODEL", None),
-            request_type="chat",
-        )
+        reply = await llm_handler.get_llm_response(**llm_kwargs)
 
         logger.info("[%s] LLM returned (len=%d)", debug_id, len(reply or ""))
         logger.debug("[%s] LLM reply (truncated): %s", debug_id, (reply or "")[:2000])
@@ -411,72 +864,23 @@ async def chat_endpoint(request: Request):
     except Exception as e:
         logger.exception("[%s] LLM call exception: %s", debug_id, e)
         err_msg = "⚠️ Assistant failed to generate a response (LLM error). Check server logs."
-        db.save_message(conversation_id, role="assistant", text=err_msg, file_url=None)
-        return JSONResponse({"reply": err_msg, "error": str(e)}, status_code=500)
+        _save_turn(background_tasks, conversation_id, user_msg, err_msg)
+        return OrjsonResponse({"reply": err_msg, "error": str(e)}, status_code=500)
 
     # Fallback if LLM returns empty or whitespace
     if not reply or not str(reply).strip():
         logger.warning("[%s] LLM returned empty reply, using fallback message.", debug_id)
-        fallback = "I don't have that information right now. Would you like me to connect you with our team?"
-        db.save_message(conversation_id, role="assistant", text=fallback, file_url=None)
-        return JSONResponse({"reply": fallback, "session_id": session_id})
+        fallback = FALLBACK_REPLY
+        _save_turn(background_tasks, conversation_id, user_msg, fallback)
+        return OrjsonResponse({"reply": fallback, "session_id": session_id})
 
     # Post-process reply: remove greeting/lead-ins if user did not greet
-    cleaned = _clean_reply(reply, message_text, allow_greeting=_is_short_greeting(message_text))
+    cleaned = _clean_reply(reply, message_text, allow_greeting=is_greeting)
     if not cleaned:
-        cleaned = "I don't have that information right now. Would you like me to connect you with our team?"
-
-    db.save_message(conversation_id, role="assistant", text=cleaned, file_url=None)
-
-    # Lead detection
-    def extract_contact(text: str):
-        email_re = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
-        phone_re = r"(\+?\d[\d\s\-\(\)]{6,}\d)"
-        return bool(re.search(email_re, text)), bool(re.search(phone_re, text))
-
-    KEYWORD_WEIGHTS = {
-        r"\b(demo|schedule demo|book demo)\b": 0.95,
-        r"\b(price|pricing|cost|quote)\b": 0.85,
-        r"\b(interested|want to buy|purchase|signup|sign up|get started)\b": 0.75,
-        r"\b(contact|call me|reach out|connect)\b": 0.65,
-        r"\b(schedule|meeting|request demo)\b": 0.8,
-    }
-
-    def compute_interest_score(text: str):
-        score = 0.0
-        txt = (text or "").lower()
-        for kw_re, w in KEYWORD_WEIGHTS.items():
-            if re.search(kw_re, txt):
-                score = max(score, w)
-        return score
-
-    combined_text = (message_text or "") + " " + (cleaned or "")
-    contact_email_present, contact_phone_present = extract_contact(combined_text)
-    score_message = compute_interest_score(message_text)
-    score_combined = compute_interest_score(combined_text)
-
-    if contact_email_present or contact_phone_present:
-        score_combined = max(score_combined, 0.98)
-
-    LEAD_THRESHOLD = float(os.environ.get("LEAD_THRESHOLD", 0.75))
-    is_lead = score_combined >= LEAD_THRESHOLD
+        cleaned = FALLBACK_REPLY
 
-    if not is_lead:
-        words = (message_text or "").strip().split()
-        if len(words) < 6 and any(qw in (message_text or "").lower() for qw in ["what", "who", "how", "tell", "batao", "kya"]):
-            is_lead = False
+    _save_turn(background_tasks, conversation_id, user_msg, cleaned)
 
-    lead = None
-    if is_lead:
-        lead = db.create_lead(
-            conversation_id,
-            snippet=(message_text or "")[:500],
-            score=float(score_combined),
-            metadata={"detected_contact": contact_email_present or contact_phone_present},
-        )
-        try:
-            db.notify_sales(lead)
-        except Exception as e:
-            logger.exception("Notify sales failed: %s", e)
+    is_lead, lead = await _detect_lead(conversation_id, message_text, cleaned, background_tasks, msg_lower)
 
-    return JSONResponse({"reply": cleaned, "session_id": session_id, "is_lead": is_lead, "lead": lead})
+    return OrjsonResponse({"reply": cleaned, "session_id": session_id, "is_lead": is_lead, "lead": lead})
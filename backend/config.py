@@ -8,6 +8,8 @@ MAX_MEMORY_PERCENT = int(os.environ.get("MAX_MEMORY_PERCENT", 85))
 # LLM / OpenRouter
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4o")  # change as appropriate
+# Opt-in: let the model fetch RAG context through a tool call instead of prefetching it on every turn
+RAG_TOOL_CALLING = os.environ.get("RAG_TOOL_CALLING", "0").lower() not in ("0", "false", "no")
 
 # App
 UPLOADS_ENABLED = False  # explicit guard for site-only version
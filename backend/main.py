@@ -1,6 +1,7 @@
 # backend/main.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 import os
 from pathlib import Path
@@ -8,22 +9,15 @@ import asyncio
 import signal
 import sys
 import logging
-from .api import admin_router
 
 # Force load .env from project root (same dir as backend/)
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(env_path)
 
-# Debug: print masked API key (for testing only)
 logging.basicConfig(level=logging.INFO)
-logging.info("DEBUG: .env loaded from %s", env_path)
-api_key = os.getenv("OPENROUTER_API_KEY")
-if api_key:
-    logging.info("DEBUG: OPENROUTER_API_KEY loaded ✅ -> %s", api_key[:6] + "..." + api_key[-6:])
-else:
-    logging.warning("DEBUG: OPENROUTER_API_KEY ❌ NOT FOUND")
 
 from .api import rag_router
+from .api import admin_router
 from .services import db as db_service  # used by cleanup loop
 
 app = FastAPI(
@@ -56,7 +50,7 @@ async def _cleanup_loop(poll_seconds: int = 60):
     try:
         while True:
             try:
-                deleted = db_service.cleanup_old_sessions()
+                deleted = await run_in_threadpool(db_service.cleanup_old_sessions)
                 if deleted:
                     logging.info("cleanup_old_sessions removed conversations: %s", deleted)
             except Exception as e:
@@ -69,6 +63,13 @@ async def _cleanup_loop(poll_seconds: int = 60):
 @app.on_event("startup")
 async def startup_event():
     global _cleanup_task
+    # Debug: print masked API key (for testing only); once per worker, after logging is set up
+    logging.info("DEBUG: .env loaded from %s", env_path)
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if api_key:
+        logging.info("DEBUG: OPENROUTER_API_KEY loaded ✅ -> %s", api_key[:6] + "..." + api_key[-6:])
+    else:
+        logging.warning("DEBUG: OPENROUTER_API_KEY ❌ NOT FOUND")
     # start background cleanup loop
     loop = asyncio.get_event_loop()
     _cleanup_task = loop.create_task(_cleanup_loop(poll_seconds=60))
@@ -83,8 +84,22 @@ async def shutdown_event():
             await _cleanup_task
         except asyncio.CancelledError:
             logging.info("Cleanup task cancelled on shutdown.")
+    db_service.close_all_connections()
     logging.info("Application shutdown complete.")
 
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Welcome to the Unified AI Services API. Visit /docs for more information."}
+
+
+if __name__ == "__main__":
+    # python -m backend.main
+    # uvicorn's default loop/http ("auto") pick uvloop and httptools when installed (uvicorn[standard]).
+    import uvicorn
+
+    uvicorn.run(
+        "backend.main:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", 8000)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4))),
+    )
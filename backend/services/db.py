@@ -4,6 +4,8 @@ import sqlite3
 import uuid
 import json
 import time
+import atexit
+import threading
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 
@@ -18,16 +20,63 @@ SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", 600))
 # ---------------------------
 # DB init + migrations
 # ---------------------------
+# Applied to every new connection. WAL lets readers proceed while a writer commits;
+# synchronous=NORMAL is durable enough under WAL and avoids an fsync per commit.
+_CONN_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-64000;",  # ~64 MB page cache
+    "PRAGMA mmap_size=268435456;",  # 256 MB
+)
+
+# One connection per thread, opened lazily and reused for the life of the thread
+_local = threading.local()
+_all_conns: List[sqlite3.Connection] = []
+_all_conns_lock = threading.Lock()
+_conn_generation = 0  # bumped by close_all_connections so threads reopen instead of using closed handles
+
 def _get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    """
+    Return this thread's shared connection. Callers must not close it.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "generation", None) != _conn_generation:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONN_PRAGMAS:
+            conn.execute(pragma)
+        _local.conn, _local.generation = conn, _conn_generation
+        with _all_conns_lock:
+            _all_conns.append(conn)
+    elif conn.in_transaction:
+        # a previous caller failed mid-write; don't let its open transaction leak into this one
+        conn.rollback()
     return conn
 
+def close_all_connections():
+    global _conn_generation
+    with _all_conns_lock:
+        _conn_generation += 1
+        for conn in _all_conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _all_conns.clear()
+
+atexit.register(close_all_connections)
+
+# Whether conversations.last_activity exists. The schema only changes in
+# _ensure_migrations, so it is read once there instead of per call.
+HAS_LAST_ACTIVITY = False
+
 def _ensure_migrations(conn: sqlite3.Connection):
     """
     Ensure DB schema includes expected columns. Add missing columns if needed.
     This performs lightweight, idempotent migrations.
     """
+    global HAS_LAST_ACTIVITY
     cur = conn.cursor()
     # check conversations columns
     cur.execute("PRAGMA table_info(conversations);")
@@ -36,6 +85,12 @@ def _ensure_migrations(conn: sqlite3.Connection):
         cur.execute("ALTER TABLE conversations ADD COLUMN last_activity TEXT;")
         cur.execute("UPDATE conversations SET last_activity = created_at WHERE last_activity IS NULL;")
         conn.commit()
+    HAS_LAST_ACTIVITY = True
+    # admin listing and cleanup both range-scan / order by last_activity
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_conversations_last_activity ON conversations(last_activity DESC);")
+    # get_last_messages reads one conversation newest-first
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages(conversation_id, created_at DESC);")
+    conn.commit()
 
 def _init():
     conn = _get_conn()
@@ -74,26 +129,27 @@ def _init():
     """)
     conn.commit()
 
-    # Run lightweight migrations (idempotent)
+    # Run lightweight migrations (idempotent); also adds last_activity on new installs
     _ensure_migrations(conn)
 
-    # Ensure conversations table has last_activity column (for new installs, add column now)
-    cur.execute("PRAGMA table_info(conversations);")
-    cols = [r["name"] for r in cur.fetchall()]
-    if "last_activity" not in cols:
-        cur.execute("ALTER TABLE conversations ADD COLUMN last_activity TEXT;")
-        cur.execute("UPDATE conversations SET last_activity = created_at WHERE last_activity IS NULL;")
-        conn.commit()
-
-    conn.close()
 
 _init()
 
 # ---------------------------
 # Helpers
 # ---------------------------
-def _now():
-    return datetime.utcnow().isoformat() + "Z"
+def now_iso() -> str:
+    """
+    Current UTC time in the format stored in created_at / last_activity.
+    """
+    return datetime.utcnow().isoformat(timespec="microseconds") + "Z"
+
+def cutoff_iso(ttl_seconds: int) -> str:
+    """
+    ISO timestamp `ttl_seconds` ago, in the same format as now_iso(). last_activity is
+    stored in that format, so plain text comparison orders correctly and uses the index.
+    """
+    return (datetime.utcnow() - timedelta(seconds=ttl_seconds)).isoformat(timespec="microseconds") + "Z"
 
 def _parse_iso(s: Optional[str]) -> Optional[datetime]:
     if not s:
@@ -118,20 +174,19 @@ def upsert_conversation(session_id: Optional[str]):
         row = cur.fetchone()
         if row:
             # update last_activity
-            cur.execute("UPDATE conversations SET last_activity = ? WHERE id = ?", (_now(), row["id"]))
+            cur.execute("UPDATE conversations SET last_activity = ? WHERE id = ?", (now_iso(), row["id"]))
             conn.commit()
-            conn.close()
             return {"id": row["id"], "session_id": row["session_id"]}
 
     # create new conversation
     new_id = str(uuid.uuid4())
     new_session = session_id or f"sess_{uuid.uuid4().hex[:12]}"
+    now = now_iso()
     cur.execute(
         "INSERT INTO conversations (id, session_id, title, created_at, last_activity) VALUES (?, ?, ?, ?, ?)",
-        (new_id, new_session, "Chat", _now(), _now())
+        (new_id, new_session, "Chat", now, now)
     )
     conn.commit()
-    conn.close()
     return {"id": new_id, "session_id": new_session}
 
 def save_message(conversation_id: str, role: str, text: str, file_url: Optional[str] = None):
@@ -141,16 +196,35 @@ def save_message(conversation_id: str, role: str, text: str, file_url: Optional[
     conn = _get_conn()
     cur = conn.cursor()
     msg_id = str(uuid.uuid4())
+    now = now_iso()
     cur.execute(
         "INSERT INTO messages (id, conversation_id, role, text, file_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (msg_id, conversation_id, role, text, file_url, _now())
+        (msg_id, conversation_id, role, text, file_url, now)
     )
     # update conversation last_activity
-    cur.execute("UPDATE conversations SET last_activity = ? WHERE id = ?", (_now(), conversation_id))
+    cur.execute("UPDATE conversations SET last_activity = ? WHERE id = ?", (now, conversation_id))
     conn.commit()
-    conn.close()
     return msg_id
 
+def save_messages(conversation_id: str, messages: List[Dict]):
+    """
+    Save several messages (dicts with role, text, optional file_url / created_at)
+    and bump conversation last_activity, all in one transaction.
+    """
+    conn = _get_conn()
+    now = now_iso()
+    rows = [
+        (str(uuid.uuid4()), conversation_id, m["role"], m.get("text"), m.get("file_url"), m.get("created_at") or now)
+        for m in messages
+    ]
+    with conn:
+        conn.executemany(
+            "INSERT INTO messages (id, conversation_id, role, text, file_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("UPDATE conversations SET last_activity = ? WHERE id = ?", (now, conversation_id))
+    return [r[0] for r in rows]
+
 def get_last_messages(conversation_id: str, limit: int = 6) -> List[Dict]:
     """
     Return last `limit` messages ordered oldest->newest.
@@ -162,7 +236,6 @@ def get_last_messages(conversation_id: str, limit: int = 6) -> List[Dict]:
         (conversation_id, limit)
     )
     rows = cur.fetchall()
-    conn.close()
     # reverse to return oldest->newest
     rows = list(reversed(rows))
     return [{"role": r["role"], "text": r["text"], "created_at": r["created_at"]} for r in rows]
@@ -187,13 +260,12 @@ def create_lead(conversation_id: str, snippet: str, score: float = 0.5, metadata
     meta_json = json.dumps(metadata or {})
     cur.execute(
         "INSERT INTO leads (id, conversation_id, interest, score, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (lead_id, conversation_id, snippet[:120], score, meta_json, _now())
+        (lead_id, conversation_id, snippet[:120], score, meta_json, now_iso())
     )
     conn.commit()
     # fetch inserted
     cur.execute("SELECT * FROM leads WHERE id = ?", (lead_id,))
     row = cur.fetchone()
-    conn.close()
     lead = dict(row) if row else {}
     return lead
 
@@ -214,40 +286,39 @@ def delete_conversation(conversation_id: str):
     cur.execute("DELETE FROM leads WHERE conversation_id = ?", (conversation_id,))
     cur.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
     conn.commit()
-    conn.close()
     return True
 
 # ---------------------------
 # Cleanup / maintenance
 # ---------------------------
+# stays well under SQLite's bound-variable limit
+_DELETE_BATCH_SIZE = 500
+
 def cleanup_old_sessions(ttl_seconds: Optional[int] = None):
     """
     Delete conversations whose last_activity is older than TTL.
     Returns list of deleted conversation ids.
     """
     ttl = ttl_seconds if ttl_seconds is not None else SESSION_TTL_SECONDS
-    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
-    cutoff_iso = cutoff.isoformat() + "Z"
+    cutoff = cutoff_iso(ttl)
 
     conn = _get_conn()
     cur = conn.cursor()
     # Guard: ensure last_activity column exists
-    cur.execute("PRAGMA table_info(conversations);")
-    cols = [r["name"] for r in cur.fetchall()]
-    if "last_activity" not in cols:
-        conn.close()
+    if not HAS_LAST_ACTIVITY:
         return []  # nothing to cleanup if column missing
 
     # find conversations to delete
-    cur.execute("SELECT id FROM conversations WHERE last_activity < ?", (cutoff_iso,))
+    cur.execute("SELECT id FROM conversations WHERE last_activity < ?", (cutoff,))
     rows = cur.fetchall()
     ids = [r["id"] for r in rows]
 
-    for cid in ids:
-        cur.execute("DELETE FROM messages WHERE conversation_id = ?", (cid,))
-        cur.execute("DELETE FROM leads WHERE conversation_id = ?", (cid,))
-        cur.execute("DELETE FROM conversations WHERE id = ?", (cid,))
-
-    conn.commit()
-    conn.close()
+    # three IN-list deletes per batch, all in one transaction
+    with conn:
+        for start in range(0, len(ids), _DELETE_BATCH_SIZE):
+            batch = ids[start:start + _DELETE_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM messages WHERE conversation_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM leads WHERE conversation_id IN ({placeholders})", batch)
+            conn.execute(f"DELETE FROM conversations WHERE id IN ({placeholders})", batch)
     return ids
@@ -1,9 +1,12 @@
 # backend/services/llm_handler.py
 import os
+import json
+import hashlib
 import logging
-from typing import Optional
-from openai import OpenAI
-from openai import OpenAI, APIConnectionError, OpenAIError
+from typing import Optional, List, Dict, Callable, Awaitable, AsyncIterator
+from openai import AsyncOpenAI, APIConnectionError, OpenAIError
+from .ttl_cache import TTLCache
+from .rate_limiter import LLMRateLimiter
 
 # Configure logger
 logger = logging.getLogger("backend.services.llm_handler")
@@ -18,58 +21,241 @@ if not API_KEY:
     # fail-fast at startup (helps on Render)
     raise ValueError("OPENROUTER_API_KEY environment variable not set.")
 
-# Setup OpenRouter client via OpenAI SDK
-client = OpenAI(base_url=BASE_URL, api_key=API_KEY)
+# Transient failures (connection errors, 408/409/429, 5xx) are retried by the SDK with
+# exponential backoff + jitter, honouring Retry-After when OpenRouter sends it.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
 
+# Setup OpenRouter client via OpenAI SDK (async, so calls don't block the event loop)
+client = AsyncOpenAI(base_url=BASE_URL, api_key=API_KEY, max_retries=LLM_MAX_RETRIES)
 
-def get_llm_response(
-    system_prompt: str,
-    context: str,
-    user_question: str,
-    model: Optional[str] = None,
-    request_type: str = "chat",  # chat | pdf | summary
-) -> str:
+
+# Response cache: identical (model, prompt, context, question) within the TTL reuse the last answer.
+# Set LLM_CACHE_TTL_SECONDS=0 to disable.
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 4096))
+_response_cache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL_SECONDS)
+
+
+# Local throttle so bursts wait instead of hitting OpenRouter 429s. 0 = unlimited.
+LLM_RPM = int(os.getenv("LLM_RPM", 0))
+LLM_TPM = int(os.getenv("LLM_TPM", 0))
+_rate_limiter = LLMRateLimiter(rpm=LLM_RPM, tpm=LLM_TPM)
+
+
+def _estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    # ~4 characters per token for the prompt, plus the completion budget
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + max_tokens
+
+
+def cache_stats() -> dict:
     """
-    Get LLM response via OpenRouter (OpenAI SDK).
-    Dynamic max_tokens by request_type. Uses a 60s timeout for the API call.
+    Hit/miss counters of the response cache.
     """
-    model_to_use = model or DEFAULT_MODEL
+    return _response_cache.stats()
+
 
+def _cache_key(*parts: str) -> str:
+    return hashlib.blake2b("||".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+async def _create_completion(model: str, messages: List[Dict], max_tokens: int, **extra):
+    estimated = _estimate_tokens(messages, max_tokens)
+    await _rate_limiter.acquire(estimated)
+    completion = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        extra_headers={
+            "HTTP-Referer": "https://fynorra.com",
+            "X-Title": "Fynorra AI Assistant",
+        },
+        timeout=60,  # seconds
+        **extra,
+    )
+    # streamed responses carry no usage block, so they keep the estimate
+    if not extra.get("stream"):
+        usage = getattr(completion, "usage", None)
+        _rate_limiter.reconcile(estimated, getattr(usage, "total_tokens", None))
+    return completion
+
+
+def _max_tokens_for(request_type: str) -> int:
     # Dynamic token rules
     if request_type == "chat":
-        max_tokens = 500
+        return 500
     elif request_type == "pdf":
-        max_tokens = 1000
+        return 1000
     elif request_type == "summary":
-        max_tokens = 2000
-    else:
-        max_tokens = 500  # fallback
+        return 2000
+    return 500  # fallback
+
 
+def _build_messages(system_prompt: str, context: str, user_question: str) -> List[Dict]:
     # Construct user message with optional context
     user_message = (
         f"Context:\n---\n{context}\n---\n\nQuestion: {user_question}"
         if context else user_question
     )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def _response_cache_key(model, request_type, tools, system_prompt, context, user_question, cache_version) -> Optional[str]:
+    if LLM_CACHE_TTL_SECONDS <= 0:
+        return None
+    tool_names = ",".join(t.get("function", {}).get("name", "") for t in (tools or []))
+    # case / whitespace variants of the same question share an entry
+    question = " ".join((user_question or "").lower().split())
+    return _cache_key(model, request_type, tool_names, system_prompt, context or "", question, cache_version)
 
+
+async def _run_tool_calls(messages: List[Dict], calls: List[Dict], tool_handler) -> None:
+    """
+    Append the assistant tool-call turn and one tool result message per call.
+    `calls` items are {"id", "name", "arguments"} with arguments as a JSON string.
+    """
+    messages.append({
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+            for c in calls
+        ],
+    })
+    for c in calls:
+        try:
+            args = json.loads(c["arguments"] or "{}")
+        except ValueError:
+            args = {}
+        result = await tool_handler(c["name"], args)
+        messages.append({"role": "tool", "tool_call_id": c["id"], "content": result or ""})
+
+
+async def get_llm_response(
+    system_prompt: str,
+    context: str,
+    user_question: str,
+    model: Optional[str] = None,
+    request_type: str = "chat",  # chat | pdf | summary
+    tools: Optional[List[Dict]] = None,
+    tool_handler: Optional[Callable[[str, Dict], Awaitable[str]]] = None,
+    use_cache: bool = True,
+    cache_version: str = "",
+) -> str:
+    """
+    Get LLM response via OpenRouter (OpenAI SDK).
+    Dynamic max_tokens by request_type. Uses a 60s timeout for the API call.
+    If `tools` are given, tool calls emitted by the model are resolved through
+    `tool_handler(name, arguments)` and the model is asked once more for the final answer.
+    Set `use_cache=False` for questions that must always get a fresh answer.
+    `cache_version` identifies the data behind the answer (e.g. a corpus mtime) when it
+    is not part of `context`, as with tool calling; changing it invalidates cached replies.
+    """
+    model_to_use = model or DEFAULT_MODEL
+    max_tokens = _max_tokens_for(request_type)
+    messages = _build_messages(system_prompt, context, user_question)
+
+    cache_key = _response_cache_key(model_to_use, request_type, tools, system_prompt, context, user_question, cache_version) if use_cache else None
+    if cache_key:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("LLM response cache hit (%s)", cache_key)
+            return cached
+
+    try:
+        extra = {"tools": tools} if tools else {}
+        completion = await _create_completion(model_to_use, messages, max_tokens, **extra)
+        message = completion.choices[0].message
+
+        if tools and tool_handler and message.tool_calls:
+            calls = [
+                {"id": c.id, "name": c.function.name, "arguments": c.function.arguments}
+                for c in message.tool_calls
+            ]
+            await _run_tool_calls(messages, calls, tool_handler)
+            # second round must answer from the tool results, not call again
+            completion = await _create_completion(model_to_use, messages, max_tokens, tools=tools, tool_choice="none")
+            message = completion.choices[0].message
+
+        reply = (message.content or "").strip()
+        if cache_key and reply:
+            _response_cache.put(cache_key, reply)
+        return reply
+    except APIConnectionError as e:
+        logger.exception("OpenRouter connection error: %s", e)
+        raise
+    except OpenAIError as e:
+        logger.exception("OpenRouter API error: %s", e)
+        raise
+
+
+async def stream_llm_response(
+    system_prompt: str,
+    context: str,
+    user_question: str,
+    model: Optional[str] = None,
+    request_type: str = "chat",
+    tools: Optional[List[Dict]] = None,
+    tool_handler: Optional[Callable[[str, Dict], Awaitable[str]]] = None,
+    use_cache: bool = True,
+    cache_version: str = "",
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of get_llm_response: yields content deltas as they arrive.
+    Tool calls are accumulated from the stream, resolved, and the final answer is streamed.
+    """
+    model_to_use = model or DEFAULT_MODEL
+    max_tokens = _max_tokens_for(request_type)
+    messages = _build_messages(system_prompt, context, user_question)
+
+    cache_key = _response_cache_key(model_to_use, request_type, tools, system_prompt, context, user_question, cache_version) if use_cache else None
+    if cache_key:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("LLM response cache hit (%s)", cache_key)
+            yield cached
+            return
+
+    parts: List[str] = []
     try:
-        completion = client.chat.completions.create(
-            model=model_to_use,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7,
-            extra_headers={
-                "HTTP-Referer": "https://fynorra.com",
-                "X-Title": "Fynorra AI Assistant",
-            },
-            timeout=60,  # seconds
-        )
-        return completion.choices[0].message.content.strip()
+        extra = {"tools": tools} if tools else {}
+        stream = await _create_completion(model_to_use, messages, max_tokens, stream=True, **extra)
+        calls: Dict[int, Dict] = {}
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                parts.append(delta.content)
+                yield delta.content
+            for tc in delta.tool_calls or []:
+                slot = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                if tc.id:
+                    slot["id"] = tc.id
+                if tc.function:
+                    slot["name"] += tc.function.name or ""
+                    slot["arguments"] += tc.function.arguments or ""
+
+        if tools and tool_handler and calls:
+            await _run_tool_calls(messages, [calls[i] for i in sorted(calls)], tool_handler)
+            stream = await _create_completion(
+                model_to_use, messages, max_tokens, stream=True, tools=tools, tool_choice="none"
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
     except APIConnectionError as e:
         logger.exception("OpenRouter connection error: %s", e)
         raise
     except OpenAIError as e:
         logger.exception("OpenRouter API error: %s", e)
         raise
+
+    reply = "".join(parts).strip()
+    if cache_key and reply:
+        _response_cache.put(cache_key, reply)
@@ -1,7 +1,104 @@
-import fitz  # PyMuPDF
-from typing import List
 import os
 import io
+import logging
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger("backend.services.pdf_processor")
+
+# Below this many pages the process-pool startup costs more than it saves
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 32))
+
+# Pages with less extracted text than this are treated as scans: rendered and OCR'd.
+# Set PDF_OCR_MIN_CHARS=0 to disable the OCR fallback.
+OCR_MIN_CHARS = int(os.environ.get("PDF_OCR_MIN_CHARS", 20))
+OCR_DPI = int(os.environ.get("PDF_OCR_DPI", 200))
+
+@lru_cache(maxsize=1)
+def _ocr_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+        import pytesseract
+        pytesseract.get_tesseract_version()  # the Python package alone is not enough
+        return True
+    except Exception:
+        return False
+
+def _page_text(page, ocr: bool) -> str:
+    text = page.get_text("text")
+    if ocr and len(text.strip()) < OCR_MIN_CHARS:
+        # only low-text pages are rasterized; native-text pages never pay for OCR
+        try:
+            png = page.get_pixmap(dpi=OCR_DPI).tobytes("png")
+            text = ocr_image(png) or text
+        except Exception:
+            # a failed OCR must not cost us the rest of the document
+            logger.warning("OCR failed for page %d; keeping its text layer", page.number, exc_info=True)
+    return text
+
+def _extract_page_range(path: str, start: int, stop: int, ocr: bool = False) -> List[str]:
+    # runs in a worker process: PyMuPDF documents must not be shared across threads/processes
+    with fitz.open(path) as doc:
+        return [_page_text(doc[i], ocr) for i in range(start, stop)]
+
+def extract_text_from_pdf(data: bytes) -> str:
+    """
+    Extract plain text from PDF bytes, one page per line block.
+    Large documents are split into page ranges extracted in parallel processes.
+    Pages with (almost) no text layer fall back to OCR when pytesseract is installed.
+    """
+    ocr = OCR_MIN_CHARS > 0 and _ocr_available()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        n = doc.page_count
+        if n < PARALLEL_MIN_PAGES:
+            return "\n".join(_page_text(page, ocr) for page in doc)
+
+    workers = min(os.cpu_count() or 1, 8)
+    step = -(-n // workers)  # ceil
+    starts = list(range(0, n, step))
+    stops = [min(s + step, n) for s in starts]
+    # workers get a path and their page range instead of a pickled copy of the whole PDF
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # spawn, not fork: forking a threaded server can copy locks held by other threads
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(starts), mp_context=ctx) as ex:
+            parts = ex.map(_extract_page_range, [path] * len(starts), starts, stops, [ocr] * len(starts))
+            return "\n".join(text for chunk in parts for text in chunk)
+    finally:
+        os.remove(path)
+
+# OCR results keyed by a hash of the image bytes + language; re-ingesting the same scan is a file read
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ocr_cache"))
+
+def _ocr_cache_path(data: bytes, lang: str) -> str:
+    key = hashlib.sha256(data + b"\0" + lang.encode("utf-8")).hexdigest()
+    return os.path.join(OCR_CACHE_DIR, key[:2], key + ".txt")
+
+def _ocr_cache_get(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _ocr_cache_put(path: str, text: str):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except OSError:
+        pass  # the cache is best-effort
 
 def parse_pdf(path_or_bytes):
     """
@@ -20,9 +117,10 @@ def parse_pdf(path_or_bytes):
     except Exception as e:
         raise
 
-def ocr_image(path_or_bytes):
+def ocr_image(path_or_bytes, lang: str = "eng"):
     """
     Basic OCR wrapper: for now read file bytes and run pytesseract if available.
+    Results are cached on disk by image content, so identical pages are OCR'd once.
     Returns extracted text (string).
     """
     try:
@@ -32,11 +130,19 @@ def ocr_image(path_or_bytes):
         return ""  # if OCR libs not installed, return empty string
 
     if isinstance(path_or_bytes, (bytes, bytearray)):
-        img = Image.open(io.BytesIO(path_or_bytes))
+        data = bytes(path_or_bytes)
     elif isinstance(path_or_bytes, str) and os.path.exists(path_or_bytes):
-        img = Image.open(path_or_bytes)
+        with open(path_or_bytes, "rb") as f:
+            data = f.read()
     else:
         raise ValueError("ocr_image expects file path or bytes")
 
-    text = pytesseract.image_to_string(img)
+    cache_path = _ocr_cache_path(data, lang)
+    cached = _ocr_cache_get(cache_path)
+    if cached is not None:
+        return cached
+
+    img = Image.open(io.BytesIO(data))
+    text = pytesseract.image_to_string(img, lang=lang)
+    _ocr_cache_put(cache_path, text)
     return text
@@ -0,0 +1,62 @@
+# backend/services/rate_limiter.py
+import time
+import asyncio
+from typing import Optional
+
+
+class AsyncTokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute.
+    `acquire` waits (instead of failing) until enough tokens are available.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0  # tokens per second
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()  # waiters are served in arrival order
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # a single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, delta: float):
+        """
+        Give back (positive) or charge (negative) tokens after the real cost is known.
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + delta)
+
+
+class LLMRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits for LLM calls.
+    A limit of 0 disables that meter.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm_bucket: Optional[AsyncTokenBucket] = AsyncTokenBucket(rpm) if rpm > 0 else None
+        self.tpm_bucket: Optional[AsyncTokenBucket] = AsyncTokenBucket(tpm) if tpm > 0 else None
+
+    async def acquire(self, estimated_tokens: int):
+        if self.rpm_bucket:
+            await self.rpm_bucket.acquire(1)
+        if self.tpm_bucket:
+            await self.tpm_bucket.acquire(estimated_tokens)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        # estimate then reconcile: refund (or charge) the difference once usage is reported
+        if self.tpm_bucket and actual_tokens is not None:
+            self.tpm_bucket.adjust(estimated_tokens - actual_tokens)
@@ -1,10 +1,22 @@
 # backend/services/vector_store.py
 import os
-import json
+import time
 import uuid
+import atexit
+import logging
 import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import List, Dict, Optional
 
+import orjson
+
+try:
+    import fcntl  # POSIX only; without it writes from several workers are not merged
+except ImportError:
+    fcntl = None
+
 # embeddings
 from sentence_transformers import SentenceTransformer
 import numpy as np
@@ -12,47 +24,392 @@ import numpy as np
 # faiss
 import faiss
 
+logger = logging.getLogger("backend.services.vector_store")
+
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 VECTOR_DIR = os.environ.get("VECTOR_DIR", os.path.join(BASE_DIR, "..", "vector_store"))
 os.makedirs(VECTOR_DIR, exist_ok=True)
 VECTOR_INDEX_PATH = os.path.join(VECTOR_DIR, "faiss.index")
 VECTOR_META_PATH = os.path.join(VECTOR_DIR, "metadata.json")
+VECTOR_LOCK_PATH = os.path.join(VECTOR_DIR, ".write.lock")
 EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "torch" (default), "onnx" or "openvino"; ONNX Runtime avoids PyTorch dispatch overhead on CPU.
+# EMBEDDING_ONNX_FILE picks a specific export, e.g. "onnx/model_qint8_avx512_vnni.onnx" (int8).
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_FILE = os.environ.get("EMBEDDING_ONNX_FILE")
+# "flat" = exact brute-force search; "hnsw" = approximate graph search, sub-linear in corpus size
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "flat").lower()
+HNSW_M = int(os.environ.get("VECTOR_HNSW_M", 32))
+HNSW_EF_SEARCH = int(os.environ.get("VECTOR_HNSW_EF_SEARCH", 64))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("VECTOR_HNSW_EF_CONSTRUCTION", 200))
+# stored vector precision: "fp32" (exact), "fp16" (half the memory) or "int8" (a quarter)
+EMBED_QUANT = os.environ.get("EMBED_QUANT", "fp32").lower()
+# upserts are persisted by a background flush this many seconds after the first unsaved change
+VECTOR_FLUSH_DELAY_SECONDS = float(os.environ.get("VECTOR_FLUSH_DELAY_SECONDS", 2.0))
+# chunks per forward pass when embedding an upload (SentenceTransformer default is 32)
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+# opt-in: concurrent query embeddings arriving within this window share one forward pass;
+# every uncached query waits this long, so only worth it under concurrent load (0 = off)
+EMBED_QUERY_BATCH_DELAY_MS = float(os.environ.get("EMBED_QUERY_BATCH_DELAY_MS", 0))
+
+class _RWLock:
+    """
+    Many concurrent readers or one writer. A waiting writer blocks new readers,
+    so a steady stream of searches cannot starve an upsert.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
 
-_lock = threading.Lock()
+# searches share the read side (FAISS search is safe for concurrent readers);
+# upserts, reloads and flushes take the write side
+_rw = _RWLock()
+
+def _load_model() -> SentenceTransformer:
+    if EMBEDDING_BACKEND != "torch":
+        try:
+            model_kwargs = {"file_name": EMBEDDING_ONNX_FILE} if EMBEDDING_ONNX_FILE else {}
+            return SentenceTransformer(EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND, model_kwargs=model_kwargs)
+        except Exception as e:
+            print(f"embedding backend {EMBEDDING_BACKEND} unavailable, falling back to torch:", e)
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
 
 # Load model once
-_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+_model = _load_model()
 _dim = _model.get_sentence_embedding_dimension()
 
-# In-memory metadata list (parallel to FAISS IDs)
-if os.path.exists(VECTOR_META_PATH):
-    with open(VECTOR_META_PATH, "r", encoding="utf-8") as f:
-        _metadata = json.load(f)
-else:
-    _metadata = []  # list of dicts containing {id, text, source, conversation_id, other_meta}
-
-# Load or init FAISS index
-if os.path.exists(VECTOR_INDEX_PATH):
-    try:
-        _index = faiss.read_index(VECTOR_INDEX_PATH)
-        # Ensure dimension matches
-        if _index.d != _dim:
-            # rebuild index if mismatch
-            _index = faiss.IndexFlatIP(_dim)
-            # if there are existing metadata, re-embed? safer to start fresh
-            _metadata = []
-    except Exception as e:
-        print("faiss load error:", e)
-        _index = faiss.IndexFlatIP(_dim)
-else:
-    _index = faiss.IndexFlatIP(_dim)  # inner product (use normalized vectors)
+_QUANT_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
 
 # helper: normalize vectors for IP similarity
 def _normalize(v: np.ndarray) -> np.ndarray:
+    # float32 in place: no copy when the model already returns float32
+    v = np.asarray(v, dtype=np.float32)
     norms = np.linalg.norm(v, axis=1, keepdims=True)
     norms[norms == 0] = 1.0
-    return v / norms
+    v /= norms
+    return v
+
+def _train_unit_range(index):
+    # Vectors are unit-norm, so every component lies in [-1, 1]. Training on those two
+    # corners fixes that range up front instead of learning it from the first (possibly
+    # single-chunk) upsert, which would clip everything added later.
+    bounds = np.vstack([-np.ones(_dim), np.ones(_dim)]).astype("float32")
+    index.train(bounds)
+    return index
+
+def _new_index():
+    # inner product over normalized vectors == cosine similarity
+    qtype = _QUANT_TYPES.get(EMBED_QUANT)
+    if VECTOR_INDEX_TYPE == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(_dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            _train_unit_range(index)
+        else:
+            index = faiss.IndexHNSWFlat(_dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if qtype is not None:
+        return _train_unit_range(faiss.IndexScalarQuantizer(_dim, qtype, faiss.METRIC_INNER_PRODUCT))
+    return faiss.IndexFlatIP(_dim)
+
+def _add_vectors(index, vectors: np.ndarray):
+    # indexes from _new_index come pre-trained; this only covers foreign/older index files
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+def _index_file_mtime() -> Optional[int]:
+    try:
+        return os.stat(VECTOR_INDEX_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+def _migrate_index(old_index):
+    """
+    Copy the (already normalized) vectors of a persisted index into a new index of the
+    configured type. IDs stay in insertion order, so the metadata list still lines up.
+    """
+    index = _new_index()
+    if old_index.ntotal:
+        _add_vectors(index, old_index.reconstruct_n(0, old_index.ntotal))
+    return index
+
+def _matches_config(index) -> bool:
+    """
+    Whether a loaded index has the configured kind (flat / hnsw) and storage precision.
+    """
+    index = faiss.downcast_index(index)
+    is_hnsw = isinstance(index, faiss.IndexHNSW)
+    if is_hnsw != (VECTOR_INDEX_TYPE == "hnsw"):
+        return False
+    storage = faiss.downcast_index(index.storage) if is_hnsw else index
+    qtype = _QUANT_TYPES.get(EMBED_QUANT)
+    if qtype is None:
+        return isinstance(storage, faiss.IndexFlat)
+    return isinstance(storage, faiss.IndexScalarQuantizer) and storage.sq.qtype == qtype
+
+def _has_narrow_sq_range(index) -> bool:
+    """
+    True for 8-bit quantizers trained on less than the unit range (older indexes learned it
+    from their first upsert), which clip every vector outside that range.
+    """
+    index = faiss.downcast_index(index)
+    storage = faiss.downcast_index(index.storage) if isinstance(index, faiss.IndexHNSW) else index
+    if not isinstance(storage, faiss.IndexScalarQuantizer) or storage.sq.qtype != faiss.ScalarQuantizer.QT_8bit:
+        return False
+    trained = faiss.vector_to_array(storage.sq.trained)  # per-dimension [vmin..., vdiff...]
+    vmin, vdiff = trained[:_dim], trained[_dim:]
+    return bool(np.any(vmin > -1 + 1e-6) or np.any(vmin + vdiff < 1 - 1e-6))
+
+def _reembed(metadata: List[Dict]):
+    """
+    Build a fresh index from the stored chunk texts (exact, unlike reconstructing quantized vectors).
+    """
+    index = _new_index()
+    if metadata:
+        texts = [m.get("text") or "" for m in metadata]
+        embeddings = _model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False)
+        _add_vectors(index, _normalize(embeddings))
+    return index
+
+def _load_from_disk():
+    """
+    Returns (index, metadata, rebuilt) from VECTOR_DIR, or a fresh empty index.
+    `rebuilt` is True when the stored index was migrated or re-embedded and should be persisted.
+    """
+    rebuilt = False
+    # In-memory metadata list (parallel to FAISS IDs)
+    if os.path.exists(VECTOR_META_PATH):
+        with open(VECTOR_META_PATH, "rb") as f:
+            metadata = orjson.loads(f.read())
+    else:
+        metadata = []  # list of dicts containing {id, text, source, conversation_id, other_meta}
+
+    # Load or init FAISS index
+    if os.path.exists(VECTOR_INDEX_PATH):
+        try:
+            index = faiss.read_index(VECTOR_INDEX_PATH)
+            # Ensure dimension matches
+            if index.d != _dim:
+                # rebuild index if mismatch
+                index = _new_index()
+                # if there are existing metadata, re-embed? safer to start fresh
+                metadata = []
+            elif _has_narrow_sq_range(index):
+                if len(metadata) == index.ntotal:
+                    logger.warning("vector index int8 range is narrower than [-1, 1]; re-embedding %d chunks", len(metadata))
+                    index, rebuilt = _reembed(metadata), True
+                else:
+                    logger.warning("vector index int8 range is narrower than [-1, 1] and metadata is out of sync; "
+                                   "search results may be degraded until the index is rebuilt")
+                    if not _matches_config(index):
+                        index, rebuilt = _migrate_index(index), True
+            elif not _matches_config(index):
+                # VECTOR_INDEX_TYPE / EMBED_QUANT changed since the index was written
+                index, rebuilt = _migrate_index(index), True
+        except Exception as e:
+            print("faiss load error:", e)
+            index = _new_index()
+    else:
+        index = _new_index()  # inner product (use normalized vectors)
+    return index, metadata, rebuilt
+
+_index, _metadata, _rebuilt_on_load = _load_from_disk()
+# mtime of the index file we last loaded or wrote; other workers' writes change it
+_disk_mtime = _index_file_mtime()
+
+# set while in-memory changes have not been written to VECTOR_DIR yet
+_dirty = threading.Event()
+_flusher: Optional[threading.Thread] = None
+# (embeddings, metadata entries) upserted since the last load/persist, replayed onto
+# another worker's newer file when we persist
+_pending: List[tuple] = []
+
+@contextmanager
+def _file_lock():
+    """
+    Exclusive lock across worker processes for the read-merge-write in _persist_locked.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(VECTOR_LOCK_PATH, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _reload_if_changed():
+    """
+    Pick up an index persisted by another worker process. Call with the write lock held.
+    """
+    global _index, _metadata, _disk_mtime
+    if _dirty.is_set():
+        return  # _persist_locked merges the other worker's file with our pending upserts
+    with _file_lock():  # don't read metadata and index halfway through another worker's write
+        mtime = _index_file_mtime()
+        if mtime is not None and mtime != _disk_mtime:
+            _index, _metadata, rebuilt = _load_from_disk()
+            _disk_mtime = mtime
+            if rebuilt:
+                _dirty.set()
+                _ensure_flusher()
+
+def _reload_if_stale():
+    # cheap unlocked stat first; only take the write lock when the file actually changed
+    if not _dirty.is_set() and _index_file_mtime() != _disk_mtime:
+        with _rw.write():
+            _reload_if_changed()
+
+def _persist_locked():
+    """
+    Write metadata and index atomically (temp file + os.replace). Call with the write lock held.
+    If another worker saved since we loaded, its file is reloaded and our pending upserts
+    are replayed onto it first, so neither worker's chunks are lost.
+    """
+    global _index, _metadata, _disk_mtime
+    with _file_lock():
+        mtime = _index_file_mtime()
+        if mtime is not None and mtime != _disk_mtime:
+            index, metadata, _ = _load_from_disk()
+            for embeddings, entries in _pending:
+                _add_vectors(index, embeddings)
+                metadata.extend(entries)
+            _index, _metadata = index, metadata
+        tmp_meta = VECTOR_META_PATH + ".tmp"
+        with open(tmp_meta, "wb") as f:
+            f.write(orjson.dumps(_metadata))
+        os.replace(tmp_meta, VECTOR_META_PATH)
+        # index last: its mtime is what other workers watch, so metadata is already in place
+        tmp_index = VECTOR_INDEX_PATH + ".tmp"
+        faiss.write_index(_index, tmp_index)
+        os.replace(tmp_index, VECTOR_INDEX_PATH)
+        _disk_mtime = _index_file_mtime()
+        _pending.clear()
+
+def flush_now():
+    """
+    Persist pending upserts immediately (also run at interpreter exit).
+    """
+    with _rw.write():
+        if not _dirty.is_set():
+            return
+        try:
+            _persist_locked()
+            _dirty.clear()
+        except Exception as e:
+            print("vector_store.flush error:", e)
+
+def _flush_loop():
+    while True:
+        _dirty.wait()
+        # let a burst of upserts (e.g. one chunk at a time from a UI) coalesce into one write
+        time.sleep(VECTOR_FLUSH_DELAY_SECONDS)
+        flush_now()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, name="vector-store-flush", daemon=True)
+        _flusher.start()
+
+atexit.register(flush_now)
+
+if _rebuilt_on_load:
+    # persist a migrated / re-embedded index once instead of redoing it on every start
+    _dirty.set()
+    _ensure_flusher()
+
+class _QueryBatcher:
+    """
+    Dynamic batching for query embeddings. The first caller of a batch waits
+    `delay` seconds for concurrent callers to join, then encodes everyone's
+    query in one model call; the others just wait for their result.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []  # (query, Future)
+
+    def embed(self, query: str) -> np.ndarray:
+        if self.delay <= 0:
+            return _model.encode([query], convert_to_numpy=True)[0]
+        fut: Future = Future()
+        with self._lock:
+            self._pending.append((query, fut))
+            leader = len(self._pending) == 1
+        if leader:
+            time.sleep(self.delay)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            try:
+                vecs = _model.encode([q for q, _ in batch], batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+                for (_, f), v in zip(batch, vecs):
+                    f.set_result(v)
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+        return fut.result()
+
+_query_batcher = _QueryBatcher(EMBED_QUERY_BATCH_DELAY_MS / 1000.0)
+
+# Lowercasing the cache key is only safe when the model lowercases its input itself
+_UNCASED_MODEL = bool(getattr(getattr(_model, "tokenizer", None), "do_lower_case", False))
+
+def _query_cache_text(query: str) -> str:
+    """
+    Model input for a query, normalized so trivially different spellings share a cache
+    entry without changing the embedding: whitespace is collapsed, and case is folded
+    only for uncased models.
+    """
+    text = " ".join(query.split())
+    return text.lower() if _UNCASED_MODEL else text
+
+@lru_cache(maxsize=4096)
+def _embed_query(query: str) -> np.ndarray:
+    """
+    Normalized (1, dim) query embedding, memoized so repeated questions skip the model.
+    Returned read-only because the cached array is shared between callers.
+    """
+    q_emb = _query_batcher.embed(query).reshape(1, -1)
+    q_emb = _normalize(q_emb)
+    q_emb.setflags(write=False)
+    return q_emb
 
 def upsert_chunks(chunks: List[str], metadata: Dict):
     """
@@ -63,26 +420,33 @@ def upsert_chunks(chunks: List[str], metadata: Dict):
     if not chunks:
         return
 
-    with _lock:
-        embeddings = _model.encode(chunks, convert_to_numpy=True, show_progress_bar=False)
-        embeddings = _normalize(embeddings.astype("float32"))
+    # embed outside the lock so searches keep running meanwhile
+    embeddings = _model.encode(chunks, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False)
+    embeddings = _normalize(embeddings)
+
+    with _rw.write():
+        _reload_if_changed()
         # Add to index
         try:
-            _index.add(embeddings)
+            _add_vectors(_index, embeddings)
+            # one urandom read for all ids instead of one per chunk; same UUID4 format as before
+            rand = os.urandom(16 * len(chunks))
             # append metadata entries for each embedding
-            for i, chunk in enumerate(chunks):
-                entry = {
-                    "id": str(uuid.uuid4()),
+            entries = [
+                {
+                    "id": str(uuid.UUID(bytes=rand[16 * i:16 * i + 16], version=4)),
                     "text": chunk,
                     "source": metadata.get("source"),
                     "conversation_id": metadata.get("conversation_id"),
                     "meta": metadata.get("meta", {})
                 }
-                _metadata.append(entry)
-            # persist
-            faiss.write_index(_index, VECTOR_INDEX_PATH)
-            with open(VECTOR_META_PATH, "w", encoding="utf-8") as f:
-                json.dump(_metadata, f, ensure_ascii=False, indent=2)
+                for i, chunk in enumerate(chunks)
+            ]
+            _metadata.extend(entries)
+            _pending.append((embeddings, entries))
+            # persisted by the background flusher, coalescing bursts of upserts
+            _dirty.set()
+            _ensure_flusher()
         except Exception as e:
             print("vector_store.upsert_chunks error:", e)
             raise
@@ -92,12 +456,15 @@ def search(query: str, top_k: int = 4) -> List[Dict]:
     Returns list of {source, text, score, meta}
     """
     global _index, _metadata
-    if not query or _index.ntotal == 0:
+    if not query:
         return []
 
-    with _lock:
-        q_emb = _model.encode([query], convert_to_numpy=True)
-        q_emb = _normalize(q_emb.astype("float32"))
+    _reload_if_stale()
+    if _index.ntotal == 0:
+        return []
+    # encode outside the lock; only the index lookup needs a consistent snapshot
+    q_emb = _embed_query(_query_cache_text(query))
+    with _rw.read():
         try:
             D, I = _index.search(q_emb, top_k)
             results = []